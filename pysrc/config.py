@@ -0,0 +1,10 @@
+import os
+
+import dotenv
+
+# The .env file is only read once, here, and does not override variables already set
+dotenv.load_dotenv()
+
+CLIENT_ID = os.environ.get("CLIENT_ID")
+CLIENT_SECRET = os.environ.get("CLIENT_SECRET")
+TOKEN = os.environ.get("TOKEN")
@@ -1,58 +1,89 @@
-import asyncio
 import os
 import time
+from collections import deque
 
-import dotenv
+import polars as pl
+import uvloop
+from config import TOKEN
 from process import (
-    add_batch_to_df,
     batch_stream,
-    convert_batch_to_dataframe,
-    convert_to_dataframe,
+    concat_batches,
     empty_batch,
     rank_by_speed,
-    strip_data,
+    strip_max_speeds,
+    top_max_speeds,
+    update_max_speeds,
+    validate_and_batch_stream,
     validate_stream,
 )
 from rich.live import Live
-from streaming import get_bw_stream, get_bw_token
-from visualize import dataframe_to_table
-
-dotenv.load_dotenv()
+from streaming import close_token_client, get_bw_stream, get_bw_token
+from visualize import dataframe_to_table, rows_to_table
 
 DEBUG_MODE = False
 GET_NEW_TOKEN = True
 UPDATE_INTERVAL_SECONDS = 1
 NUM_VESSELS_DISPLAYED = 10
 
-# Keep all data from the last X seconds or the most recent Y entries, whichever is more inclusive
+# Keep the maximum speed of each vessel for X seconds
 DATA_TIME_TO_LIVE_SECONDS = 10
+# But always keep at least the X most recent messages
 NUM_MESSAGES_TO_KEEP = 1000
 
 
+def split_cpus():
+    """
+    Keeps one CPU free of Polars work, for the event loop and the thread reading the stream.
+
+    Polars is given one thread less than the number of CPUs. Where CPU affinity is supported, the
+    Polars thread pool is started while the process is limited to all but the first CPU, which the
+    Polars threads inherit. The affinity of the calling thread is then restored, so that it and the
+    threads it starts later may use any CPU. Must be called before Polars is first used, as the
+    thread pool is started on first use.
+    """
+    can_pin = hasattr(os, "sched_setaffinity")
+    cpus = os.sched_getaffinity(0) if can_pin else set(range(os.cpu_count() or 1))
+    os.environ.setdefault("POLARS_MAX_THREADS", str(max(len(cpus) - 1, 1)))
+
+    if can_pin and len(cpus) > 1:
+        os.sched_setaffinity(0, sorted(cpus)[1:])
+        # Polars starts its thread pool on first use, which includes threadpool_size as of Polars
+        # 0.18.13. This is not documented, and has only been checked on a host with one CPU,
+        # where the pool is not pinned.
+        pl.threadpool_size()
+        os.sched_setaffinity(0, cpus)
+
+
 def initialize_with_token(func):
     """
     A decorator that initializes a FleetSpeed client with a token.
 
     Before the execution of the decorated function, it prints an initialization message and
     fetches a Bearer token. The token is either newly obtained by calling `get_bw_token` or
-    fetched from the environment variable "TOKEN".
+    fetched from the environment variable "TOKEN". The client used to fetch the token is closed
+    when the decorated function returns.
 
     This decorator allows for reusability of token fetching and the initialization message for
     multiple functions that act as clients under different circumstances.
 
     Args:
-        func (function): The function being decorated. The function must be structurally compatible
-        for receiving a token as the first argument.
+        func (function): The coroutine function being decorated. The function must be structurally
+        compatible for receiving a token as the first argument.
 
     Returns:
-        function: The decorated function, with the token as the first argument.
+        function: The decorated coroutine function, with the token as the first argument.
     """
 
-    def wrapper_func(*args, **kwargs):
+    async def wrapper_func(*args, **kwargs):
         print("Initializing FleetSpeed! Remember to always put safety first at sea.")
         print("All data provided by Kystverket/BarentsWatch.")
-        token = get_bw_token() if GET_NEW_TOKEN else os.environ["TOKEN"]
-        return func(token, *args, **kwargs)
+        try:
+            token = await get_bw_token() if GET_NEW_TOKEN else TOKEN
+            if token is None:
+                raise ValueError("TOKEN must be set when not getting a new token.")
+            return await func(token, *args, **kwargs)
+        finally:
+            await close_token_client()
 
     return wrapper_func
 
@@ -62,67 +93,57 @@ async def main_single_batch(token: str):
     """
     Asynchronously streams AIS messages, processes and ranks data for vessel speeds.
 
-    This function initializes with an empty data frame. It then continuously streams and
-    validates the AIS messages by using the provided token.
+    This function initializes with no data. It then continuously streams and validates the AIS
+    messages by using the provided token, keeping a windowed maximum speed for each vessel.
 
-    Every `UPDATE_INTERVAL_SECONDS`, it processes the received AIS messages into a dataframe,
-    ranks them by speed, and updates a live table with the top vessels.
-
-    Finally, it uses the `strip_data` function to manage the size of the stored messages.
+    Every `UPDATE_INTERVAL_SECONDS`, it drops the messages older than `DATA_TIME_TO_LIVE_SECONDS`,
+    except the `NUM_MESSAGES_TO_KEEP` most recent, ranks the vessels by their maximum speed over the
+    remaining messages, and updates a live table with the top vessels.
 
     Args:
         token (str): Token to authenticate the AIS stream source.
     """
-    full_df = empty_batch()
-
-    data = []
-    start_time = time.time()
-
-    with Live(dataframe_to_table(full_df), refresh_per_second=5) as live:
-        async for ais_msg in validate_stream(get_bw_stream(token)):
-            data.append(ais_msg)
-
-            if time.time() - start_time > UPDATE_INTERVAL_SECONDS:
-                # Process the data. Usually takes less than 1/100th of a second.
-                timer = time.time()  # debug purposes
-
-                df = convert_to_dataframe(data)
-                top = rank_by_speed(df).head(NUM_VESSELS_DISPLAYED)
-                table = dataframe_to_table(top)
-                live.update(table)
-
-                # Reset
-                start_time = time.time()
-                data = strip_data(
-                    data,
-                    time_to_live_secs=DATA_TIME_TO_LIVE_SECONDS,
-                    num_messages_to_keep=NUM_MESSAGES_TO_KEEP,
-                )
+    max_speeds = {}
+    num_messages = 0
+    ais_msg_stream = validate_stream(get_bw_stream(token))
+
+    with Live(rows_to_table([]), refresh_per_second=5) as live:
+        async for batch in batch_stream(ais_msg_stream, UPDATE_INTERVAL_SECONDS):
+            timer = time.time()  # debug purposes
+
+            for ais_msg in batch:
+                update_max_speeds(max_speeds, ais_msg, num_messages)
+                num_messages += 1
+
+            strip_max_speeds(
+                max_speeds, DATA_TIME_TO_LIVE_SECONDS, NUM_MESSAGES_TO_KEEP, num_messages
+            )
+            top = top_max_speeds(max_speeds, NUM_VESSELS_DISPLAYED)
+            table = rows_to_table(top)
+            live.update(table)
 
-                if DEBUG_MODE:
-                    print(
-                        f"Used {len(df)} messages and {time.time() - timer}s to display."
-                    )  # -> Used 1518 messages and 0.004235029220581055s to display.
+            if DEBUG_MODE:
+                print(f"Used {len(max_speeds)} vessels and {time.time() - timer}s to display.")
 
 
 @initialize_with_token
 async def main_multi_batch(token: str):
     """Alternative approach to main_single_batch(), found to be less effective and was not
     sufficiently tuned."""
-    batch_number = 0
-    full_df = empty_batch()
+    # The oldest batch is dropped automatically when a new one is added to a full deque
+    batches = deque(maxlen=20)
 
-    with Live(dataframe_to_table(full_df), refresh_per_second=5) as live:
-        async for batch in batch_stream(validate_stream(get_bw_stream(token))):
-            batch_df = convert_batch_to_dataframe(batch, batch_number)
-            batch_number += 1
+    with Live(dataframe_to_table(empty_batch()), refresh_per_second=5) as live:
+        async for batch_df in validate_and_batch_stream(get_bw_stream(token)):
+            batches.append(batch_df)
 
-            full_df = add_batch_to_df(batch_df, full_df, num_batches=20)
-            top = rank_by_speed(full_df).head(10)
+            full_df = concat_batches(batches)
+            top = rank_by_speed(full_df, num_vessels=10)
 
             table = dataframe_to_table(top)
             live.update(table)
 
 
 if __name__ == "__main__":
-    asyncio.run(main_single_batch())
+    split_cpus()
+    uvloop.run(main_single_batch())
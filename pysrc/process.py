@@ -1,105 +1,190 @@
-from datetime import datetime
-from time import time, time_ns
-from typing import AsyncGenerator, TypedDict
-
+import asyncio
+import heapq
+import io
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timezone
+from time import time_ns
+from typing import Annotated, AsyncGenerator, Iterable, TypedDict, TypeVar
+
+import msgspec
 import polars as pl
-from pydantic import BaseModel, ValidationError, confloat, constr, field_validator
 
 
-class VesselDataModel(BaseModel):
+class VesselDataStruct(msgspec.Struct):
     """
-    A Pydantic model that represents vessel data.
+    A msgspec Struct that represents the fields of an AIS message that are used.
 
-    This model describes the data structure of a vessel, including its MMSI number, its speed
-    over ground, and a timestamp. It also includes two methods for validating and casting the
-    'mmsi' and 'msgtime' fields.
+    JSON is decoded directly into this Struct, with the fields type checked in the same pass and
+    any other fields skipped, without creating an intermediate dictionary.
 
     Attributes:
-        mmsi (str): An nine-digit Maritime Mobile Service Identity number.
+        mmsi (str | int): A Maritime Mobile Service Identity number, not yet validated.
         speedOverGround (float): The speed of the vessel over ground. Must be >= 0.0.
         msgtime (datetime): A datetime object representing when the message was sent.
     """
 
-    mmsi: constr(min_length=9, max_length=9, pattern=r"^\d+$")
-    speedOverGround: confloat(ge=0.0)
+    mmsi: str | int
+    speedOverGround: Annotated[float, msgspec.Meta(ge=0.0)]
     msgtime: datetime
 
-    @field_validator("mmsi", mode="before")
-    @classmethod
-    def cast_mmsi(cls, val: str | int) -> str:
-        return str(val)
-
-    @field_validator("msgtime", mode="after")
-    @classmethod
-    def truncate_ms(cls, val: datetime) -> datetime:
-        return val.replace(microsecond=0)
-
 
 class VesselDataDict(TypedDict):
     """
     A TypedDict representing the vessel data and its creation time.
 
-    This TypedDict is similar to VesselDataModel, but includes an additional field - the ns
-    precision creation time of the object itself.
+    This TypedDict describes the data structure of a vessel, including its MMSI number, its speed
+    over ground, and a timestamp. It also includes an additional field - the ns precision creation
+    time of the object itself.
 
     Attributes:
         mmsi (str): An nine-digit Maritime Mobile Service Identity number.
-        speedOverGround (float): The speed of the vessel over ground.
-        msgtime (datetime): A datetime object representing when the message was sent.
+        speedOverGround (float): The speed of the vessel over ground. Must be >= 0.0.
+        msgtime (int): When the message was sent, in ns since the Unix epoch, truncated to whole
+            seconds.
         created_at (int): The ns precision creation time of this object.
     """
 
     mmsi: str
     speedOverGround: float
-    msgtime: datetime
+    msgtime: int  # ns
     created_at: int  # ns
 
 
-def validate_extract_vessel_data(line: str) -> VesselDataDict | None:
+# The values of a VesselDataDict, in the same order
+VesselDataTuple = tuple[str, float, int, int]
+
+
+class VesselDataColumns(TypedDict):
+    """
+    A TypedDict representing a collection of vessel data, stored column by column.
+
+    Each field holds the list of values of the corresponding VesselDataDict field, such that the
+    n-th elements of all lists together make up the n-th message. This layout is converted to a
+    dataframe with a single typed pass per column.
+
+    Attributes:
+        mmsi (list[str]): Nine-digit Maritime Mobile Service Identity numbers.
+        speedOverGround (list[float]): The speeds of the vessels over ground.
+        msgtime (list[int]): When the messages were sent, in ns since the Unix epoch.
+        created_at (list[int]): The ns precision creation times of the messages, in order.
+    """
+
+    mmsi: list[str]
+    speedOverGround: list[float]
+    msgtime: list[int]  # ns
+    created_at: list[int]  # ns
+
+
+# Polars schema of VesselDataDict, built once instead of being converted from the type annotations
+# for every dataframe
+VESSEL_DATA_SCHEMA = {
+    "mmsi": pl.Utf8,
+    "speedOverGround": pl.Float64,
+    "msgtime": pl.Int64,
+    "created_at": pl.Int64,
+}
+
+# Polars schemas of the fields read from the raw AIS messages by validate_batch. Polars reads a
+# JSON number as null in a Utf8 column, so the MMSI is first read as a number, which is how the AIS
+# stream sends it, and the messages with a null MMSI are read again with a Utf8 column. The number
+# is a float, so that a non-integer MMSI is rejected rather than truncated.
+AIS_MESSAGE_SCHEMA = {
+    "mmsi": pl.Float64,
+    "speedOverGround": pl.Float64,
+    "msgtime": pl.Datetime("us"),
+}
+AIS_MESSAGE_SCHEMA_STRING_MMSI = {**AIS_MESSAGE_SCHEMA, "mmsi": pl.Utf8}
+
+# Reused for every message by validate_extract_vessel_data
+VESSEL_DATA_DECODER = msgspec.json.Decoder(VesselDataStruct)
+
+# Row masks used by validate_batch, built once instead of for every batch
+VESSEL_DATA_FILTER = (pl.col("speedOverGround") >= 0.0) & pl.col("msgtime").is_not_null()
+NUMBER_MMSI_FILTER = pl.col("mmsi").is_between(100_000_000, 999_999_999) & (
+    pl.col("mmsi") == pl.col("mmsi").floor()
+)
+STRING_MMSI_FILTER = pl.col("mmsi").str.contains(r"^[0-9]{9}$")
+
+# mmsi -> the recent messages of the vessel that may still become its maximum speed, as
+# (speedOverGround, msgtime, created_at, message number). The speeds are decreasing, so the first
+# is the maximum.
+MaxSpeeds = dict[str, deque[tuple[float, int, int, int]]]
+
+T = TypeVar("T")
+
+
+def validate_extract_vessel_data(line: str | bytes) -> VesselDataTuple | None:
     """
     Validates and extracts certain fields from a JSON string representing vessel data.
 
-    This function takes a JSON string as input, attempts to parse and validate it according to the
-    `VesselData` model. If the validation is successful, it returns a dictionary containing
-    'mmsi' and 'speedOverGround'.
+    This function takes a JSON string as input, attempts to decode and validate it according to the
+    `VesselDataStruct` Struct, and then checks the MMSI. If the validation is successful, it
+    returns a tuple containing 'mmsi', 'speedOverGround', 'msgtime' and 'created_at'.
 
-    If the validation fails due to a ValidationError (i.e., the input does not match the
-    `VesselData` model), the function will return None.
+    If the validation fails (i.e., the input is not JSON, or does not match `VesselDataStruct`),
+    the function will return None.
 
     Args:
-        line (str): A JSON string representing vessel data.
+        line (str | bytes): A JSON string representing vessel data.
 
     Returns:
-        VesselData | None: An object with 'mmsi', 'speedOverGround' and 'msgtime' attributes if the
-        input string is valid; None otherwise.
+        VesselDataTuple | None: The values of a VesselDataDict if the input string is valid; None
+        otherwise.
     """
     try:
-        vessel_data_model = VesselDataModel.model_validate_json(line)
-    except ValidationError:
-        # Ignore data errors for now
+        vessel_data = VESSEL_DATA_DECODER.decode(line)
+    except msgspec.DecodeError:
+        # Ignore data errors for now. Note that msgspec.ValidationError is a DecodeError.
+        return
+
+    mmsi = str(vessel_data.mmsi)
+
+    # Checked with str methods instead of a regex pattern, as this runs for every message
+    if len(mmsi) != 9 or not (mmsi.isascii() and mmsi.isdigit()):
         return
 
-    vessel_dict = vessel_data_model.model_dump()
-    vessel_dict["created_at"] = time_ns()
+    return (
+        mmsi,
+        vessel_data.speedOverGround,
+        datetime_to_ns(vessel_data.msgtime),
+        time_ns(),
+    )
+
+
+def datetime_to_ns(value: datetime) -> int:
+    """
+    Converts a datetime to ns since the Unix epoch, truncated to whole seconds.
+
+    Naive datetimes are taken to be in UTC, as Polars does.
+
+    Args:
+        value (datetime): The datetime to convert.
+
+    Returns:
+        int: The time in ns since the Unix epoch.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
 
-    return vessel_dict
+    return int(value.timestamp()) * 1_000_000_000
 
 
 async def validate_stream(
-    line_generator: AsyncGenerator[str, None]
-) -> AsyncGenerator[VesselDataDict, None]:
+    line_generator: AsyncGenerator[bytes, None]
+) -> AsyncGenerator[VesselDataTuple, None]:
     """
-    Asynchronously validate and extract vessel data from a text stream.
+    Asynchronously validate and extract vessel data from a stream of JSON lines.
 
     The function takes lines from the `line_generator` and validates the line content. If the
-    line contains valid vessel data, it is yielded in the VesselDataDict format.
+    line contains valid vessel data, it is yielded in the VesselDataTuple format.
 
     Args:
-        line_generator (AsyncGenerator[str, None]): An asynchronous generator yielding lines of
-        text.
+        line_generator (AsyncGenerator[bytes, None]): An asynchronous generator yielding lines of
+        JSON.
 
     Yields:
-        VesselDataDict: A dictionary containing validated vessel data.
+        VesselDataTuple: A tuple containing validated vessel data.
     """
     async for line in line_generator:
         vessel_data = validate_extract_vessel_data(line)
@@ -107,39 +192,166 @@ async def validate_stream(
             yield vessel_data
 
 
+def validate_lines(lines: list[bytes]) -> pl.DataFrame:
+    """
+    Validates and extracts vessel data from a batch of JSON lines, one line at a time.
+
+    Args:
+        lines (list[bytes]): JSON lines representing vessel data.
+
+    Returns:
+        DataFrame: Polars DataFrame with the valid vessel data, structured as VesselDataDict.
+    """
+    columns = empty_columns()
+    for vessel_data in map(validate_extract_vessel_data, lines):
+        if vessel_data:
+            append_to_columns(columns, vessel_data)
+
+    return convert_to_dataframe(columns)
+
+
+def validate_batch(lines: list[bytes]) -> pl.DataFrame:
+    """
+    Validates and extracts vessel data from a batch of JSON lines in a single vectorized pass.
+
+    The lines are parsed together as newline delimited JSON by Polars, and invalid rows are
+    removed with one boolean mask. The lines with the MMSI sent as a string, which is not what the
+    AIS stream does, are parsed again in a second pass. This gives the same result as
+    `validate_extract_vessel_data`, except that Polars reads a boolean speed as 1.0 or 0.0, and
+    accepts an MMSI sent as a float with an integer value.
+
+    If the batch cannot be parsed as a whole, e.g. due to a malformed line, it falls back to
+    validating each line separately with `validate_lines`.
+
+    Args:
+        lines (list[bytes]): JSON lines representing vessel data.
+
+    Returns:
+        DataFrame: Polars DataFrame with the valid vessel data, structured as VesselDataDict.
+    """
+    try:
+        df = pl.read_ndjson(io.BytesIO(b"\n".join(lines)), schema=AIS_MESSAGE_SCHEMA)
+    except (RuntimeError, pl.ComputeError):
+        return validate_lines(lines)
+
+    valid = df.filter(NUMBER_MMSI_FILTER & VESSEL_DATA_FILTER).with_columns(
+        pl.col("mmsi").cast(pl.Int64).cast(pl.Utf8)
+    )
+
+    string_mmsi_rows = df.get_column("mmsi").is_null().arg_true()
+    if len(string_mmsi_rows) > 0:
+        # Polars skips blank lines, so the rows only match the lines if there are none
+        if df.height != len(lines):
+            return validate_lines(lines)
+
+        string_mmsi_lines = b"\n".join(lines[row] for row in string_mmsi_rows)
+        df = pl.read_ndjson(io.BytesIO(string_mmsi_lines), schema=AIS_MESSAGE_SCHEMA_STRING_MMSI)
+        valid = pl.concat([valid, df.filter(STRING_MMSI_FILTER & VESSEL_DATA_FILTER)])
+
+    return valid.select(
+        "mmsi",
+        "speedOverGround",
+        pl.col("msgtime").dt.truncate("1s").dt.epoch("ns"),
+        pl.lit(time_ns()).alias("created_at"),
+    )
+
+
 async def batch_stream(
-    ais_msg_generator: AsyncGenerator[VesselDataDict, None],
+    item_generator: AsyncGenerator[T, None],
     batch_interval_secs: int = 1,
-) -> AsyncGenerator[list[VesselDataDict], None]:
+) -> AsyncGenerator[list[T], None]:
     """
-    Asynchronously batch vessel data messages in the given time interval.
+    Asynchronously batch the items of a stream in the given time interval.
+
+    The function forms batches from the `item_generator`, each batch covering the provided
+    `batch_interval_secs` duration. Each batch is then yielded as a list of items, e.g. vessel
+    data messages or raw lines of text.
 
-    The function forms batches from the `ais_msg_generator`, each batch covering the provided
-    `batch_interval_secs` duration. Each batch is then yielded as a list of VesselDataDict.
+    The end of each interval is signalled by a timer on the event loop, so the clock is not read
+    for every item. A batch is yielded with the first item after its interval has ended.
 
     Args:
-        ais_msg_generator (AsyncGenerator[VesselDataDict, None]): An asynchronous generator
-            yielding vessel data messages represented as dictionaries.
+        item_generator (AsyncGenerator[T, None]): An asynchronous generator yielding the items.
         batch_interval_secs (int, optional): The time interval for each batch in seconds.
 
     Yields:
-        list[VesselDataDict]: A list containing batches of vessel data messages.
+        list[T]: A list containing a batch of items.
     """
-    next_batch_time = time() + batch_interval_secs
+    loop = asyncio.get_running_loop()
+    interval_ended = False
+
+    def end_interval() -> None:
+        nonlocal interval_ended
+        interval_ended = True
+
+    timer = loop.call_later(batch_interval_secs, end_interval)
     batch = []
 
-    async for ais_msg_generator in ais_msg_generator:
-        batch.append(ais_msg_generator)
+    try:
+        async for item in item_generator:
+            batch.append(item)
+
+            if interval_ended:
+                interval_ended = False
+                timer = loop.call_later(batch_interval_secs, end_interval)
 
-        if (curr_time := time()) > next_batch_time:
-            yield batch
-            batch = []
-            next_batch_time = curr_time + batch_interval_secs
+                yield batch
+                batch = []
+    finally:
+        timer.cancel()
+
+
+async def validate_and_batch_stream(
+    line_generator: AsyncGenerator[bytes, None],
+    batch_interval_secs: int = 1,
+) -> AsyncGenerator[pl.DataFrame, None]:
+    """
+    Asynchronously batch and validate vessel data from a stream of JSON lines.
+
+    The lines are collected in batches covering `batch_interval_secs`, and each batch is validated
+    as a whole by `validate_batch`, without going through Python objects for every message.
+
+    Args:
+        line_generator (AsyncGenerator[bytes, None]): An asynchronous generator yielding lines of
+        JSON.
+        batch_interval_secs (int, optional): The time interval for each batch in seconds.
+
+    Yields:
+        DataFrame: Polars DataFrame with the valid vessel data of a batch.
+    """
+    async for lines in batch_stream(line_generator, batch_interval_secs):
+        yield validate_batch(lines)
+
+
+def empty_columns() -> VesselDataColumns:
+    """
+    Returns an empty collection of vessel data, stored column by column.
+
+    Returns:
+        VesselDataColumns: A dictionary of empty lists.
+    """
+    return {"mmsi": [], "speedOverGround": [], "msgtime": [], "created_at": []}
+
+
+def append_to_columns(columns: VesselDataColumns, vessel_data: VesselDataTuple) -> None:
+    """
+    Appends a single vessel data message to a collection of vessel data, in place.
+
+    Args:
+        columns (VesselDataColumns): The vessel data to append to.
+        vessel_data (VesselDataTuple): The message to append.
+    """
+    mmsi, speed_over_ground, msgtime, created_at = vessel_data
+
+    columns["mmsi"].append(mmsi)
+    columns["speedOverGround"].append(speed_over_ground)
+    columns["msgtime"].append(msgtime)
+    columns["created_at"].append(created_at)
 
 
 def strip_data(
-    data: list[VesselDataDict], time_to_live_secs: int, num_messages_to_keep: int
-) -> list[VesselDataDict]:
+    data: VesselDataColumns, time_to_live_secs: int, num_messages_to_keep: int
+) -> VesselDataColumns:
     """
     Filters and returns the most recent data based on the Time To Live and the number of
     messages to keep.
@@ -147,115 +359,168 @@ def strip_data(
     Data is retained if it is either withing the Time To Live or the most recent messages, or both.
 
     Args:
-        data (list[VesselDataDict]): A list of vessel data.
+        data (VesselDataColumns): Vessel data, stored column by column.
         time_to_live_secs (int): The duration in seconds for which messages are considered recent.
         num_messages_to_keep (int): The minimum number of messages to keep.
 
     Returns:
-        list[VesselDataDict]: A list of data that matched the filtering rules mentioned above.
+        VesselDataColumns: The data that matched the filtering rules mentioned above.
     """
     # Assumes ordered data!
     now = time_ns()
     time_cutoff = now - time_to_live_secs * 1e9
+    created_at = data["created_at"]
 
     # Case 1: Fewer messages than what we want to keep => keep everything
-    if len(data) <= num_messages_to_keep:
+    if len(created_at) <= num_messages_to_keep:
         return data
 
     # Case 2: The time cutoff would result in fewer than num_messages_to_keep => return fixed number
     # of messages
-    if data[-num_messages_to_keep]["created_at"] < time_cutoff:
-        return data[-num_messages_to_keep:]
+    if created_at[-num_messages_to_keep] < time_cutoff:
+        return {name: column[-num_messages_to_keep:] for name, column in data.items()}
 
-    # Case 3: Return data more recent than the cutoff
-    for n, entry in enumerate(data):
-        if entry["created_at"] >= time_cutoff:
-            return data[n:]
+    # Case 3: Return data more recent than the cutoff, found by a binary search
+    n = bisect_left(created_at, time_cutoff)
+    return {name: column[n:] for name, column in data.items()}
 
 
-def convert_batch_to_dataframe(
-    data: list[VesselDataDict], batch_number: int
-) -> pl.DataFrame:
+def convert_to_dataframe(data: VesselDataColumns) -> pl.DataFrame:
     """
-    Converts a data batch into a dataframe and assigns a batch number to it.
+    Converts vessel data, stored column by column, into a dataframe.
 
     Args:
-        data (list[VesselDataDict]): A list of vessel data dictionaries.
-        batch_number (int): The batch number to be assigned.
+        data (VesselDataColumns): Vessel data, stored column by column.
 
     Returns:
-        DataFrame: Polars DataFrame created from the batch data.
+        DataFrame: Polars DataFrame created from the data.
     """
-    df = convert_to_dataframe(data)
-    df = df.with_columns(pl.lit(batch_number).alias("batch_number"))
+    df = pl.DataFrame(data, schema=VESSEL_DATA_SCHEMA)
 
     return df
 
 
-def convert_to_dataframe(data: list[VesselDataDict]) -> pl.DataFrame:
+def empty_batch() -> pl.DataFrame:
     """
-    Converts a list of vessel data dictionaries into a dataframe.
+    Returns an empty dataframe structured as a batch of vessel data.
+
+    Returns:
+        DataFrame: an empty Polars DataFrame.
+    """
+    return convert_to_dataframe(empty_columns())
+
+
+def concat_batches(batches: Iterable[pl.DataFrame]) -> pl.DataFrame:
+    """
+    Combines batches of vessel data into a single dataframe.
+
+    The batches are not copied into contiguous memory, since the result is only read once before
+    the next batch arrives. Dropping the oldest batches is left to the caller, e.g. by keeping
+    them in a `collections.deque` with a `maxlen`.
 
     Args:
-        data (list[VesselDataDict]): A list of vessel data dictionaries.
+        batches (Iterable[DataFrame]): Batches of vessel data.
 
     Returns:
-        DataFrame: Polars DataFrame created from the data.
+        DataFrame: The batches combined, in order.
     """
-    df = pl.from_dicts(data, schema=VesselDataDict.__annotations__)
-
-    return df
+    return pl.concat(batches, rechunk=False)
 
 
-def empty_batch() -> pl.DataFrame:
+def rank_by_speed(df: pl.DataFrame, num_vessels: int | None = None) -> pl.DataFrame:
     """
-    Returns an empty dataframe structured as a batch of vessel data.
+    Ranks the vessel data by maximum speed over ground.
+
+    Each vessel is listed once, with the 'msgtime' of the message where it had its maximum speed.
+    The query is run lazily, so that Polars can plan the aggregation, sort and limit together.
+
+    Args:
+        df (DataFrame): Vessel data in DataFrame form.
+        num_vessels (int, optional): Number of vessels to keep, starting from the fastest.
 
     Returns:
-        DataFrame: an empty Polars DataFrame.
+        DataFrame: The vessels ranked by speed in descending order.
     """
-    return convert_batch_to_dataframe([], batch_number=0)
+    ranked = (
+        df.lazy()
+        .groupby("mmsi")
+        .agg(
+            pl.col("speedOverGround").max(),
+            pl.col("msgtime").take(pl.col("speedOverGround").arg_max()),
+        )
+        .sort("speedOverGround", descending=True)
+    )
+
+    if num_vessels is not None:
+        ranked = ranked.limit(num_vessels)
 
+    return ranked.select("speedOverGround", "mmsi", "msgtime").collect()
 
-def add_batch_to_df(
-    batch: pl.DataFrame, full_df: pl.DataFrame, num_batches: int | None = None
-) -> pl.DataFrame:
+
+def update_max_speeds(
+    max_speeds: MaxSpeeds, vessel_data: VesselDataTuple, message_number: int
+) -> None:
     """
-    Adds a batch of data onto an existing dataframe, keeping the most recent batches.
+    Updates the maximum speed of a vessel with a single message, in place.
+
+    This keeps a windowed maximum per vessel as the messages arrive, so that ranking the vessels
+    does not require going through all the recent messages again. A message drops the previous
+    messages that were not faster, as they can no longer be the maximum speed of the vessel.
 
     Args:
-        batch (DataFrame): New batch of data.
-        full_df (DataFrame): Existing data.
-        num_batches (int, optional): Number of recent batches to keep in the full dataframe.
+        max_speeds (MaxSpeeds): The maximum speed of each vessel.
+        vessel_data (VesselDataTuple): The message to update with.
+        message_number (int): The position of the message in the stream, counting all vessels.
+    """
+    mmsi, speed_over_ground, msgtime, created_at = vessel_data
 
-    Returns:
-        DataFrame: The dataframe with new batch added, keeping the most recent batches.
+    candidates = max_speeds.get(mmsi)
+    if candidates is None:
+        candidates = max_speeds[mmsi] = deque()
+    while candidates and candidates[-1][0] <= speed_over_ground:
+        candidates.pop()
+    candidates.append((speed_over_ground, msgtime, created_at, message_number))
+
+
+def strip_max_speeds(
+    max_speeds: MaxSpeeds, time_to_live_secs: int, num_messages_to_keep: int, num_messages: int
+) -> None:
     """
-    df = pl.concat([full_df, batch])
+    Drops the messages that are neither within the Time To Live nor among the most recent, in place.
 
-    if num_batches is not None:
-        max_batch_number = batch.select("batch_number").max().item()
+    This keeps the same messages as `strip_data`, and the maximum speed of each vessel is then its
+    maximum over those messages. Vessels without such messages are dropped.
 
-        # If there is no data, then max_batch_number will be None and we have to allow that
-        if max_batch_number is not None:
-            df = df.filter(pl.col("batch_number") > max_batch_number - num_batches)
+    Args:
+        max_speeds (MaxSpeeds): The maximum speed of each vessel.
+        time_to_live_secs (int): The duration in seconds for which messages are considered recent.
+        num_messages_to_keep (int): The minimum number of messages to keep.
+        num_messages (int): The number of messages received so far, counting all vessels.
+    """
+    time_cutoff = time_ns() - time_to_live_secs * 1_000_000_000
+    message_cutoff = num_messages - num_messages_to_keep
 
-    return df
+    for mmsi, candidates in list(max_speeds.items()):
+        while (
+            candidates and candidates[0][2] < time_cutoff and candidates[0][3] < message_cutoff
+        ):
+            candidates.popleft()
+        if not candidates:
+            del max_speeds[mmsi]
 
 
-def rank_by_speed(df: pl.DataFrame) -> pl.DataFrame:
+def top_max_speeds(max_speeds: MaxSpeeds, num_vessels: int) -> list[tuple[str, float, int]]:
     """
-    Ranks the vessel data by maximum speed over ground.
+    Ranks the vessels by maximum speed over ground and returns the fastest ones.
 
     Args:
-        df (DataFrame): Vessel data in DataFrame form.
+        max_speeds (MaxSpeeds): The maximum speed of each vessel.
+        num_vessels (int): The number of vessels to return.
 
     Returns:
-        DataFrame: The input dataframe with vessels ranked by speed in descending order.
+        list[tuple[str, float, int]]: The 'mmsi', 'speedOverGround' and 'msgtime' of the
+        fastest vessels, in descending order of speed.
     """
-    ranked = (
-        df.select(pl.col("speedOverGround").max().over("mmsi"), "mmsi", "msgtime")
-        .unique()
-        .sort("speedOverGround", descending=True)
-    )
-    return ranked
+    top = heapq.nlargest(num_vessels, max_speeds.items(), key=lambda item: item[1][0][0])
+
+    return [(mmsi, candidates[0][0], candidates[0][1]) for mmsi, candidates in top]
@@ -1,38 +1,155 @@
-import os
-from typing import AsyncGenerator
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+from pathlib import Path
+from typing import AsyncGenerator, Iterator, TypeVar
+from urllib.parse import urlencode
 
-import dotenv
 import httpx
+import msgspec
+import config
 
+T = TypeVar("T")
 
-def get_bw_token() -> str:
-    dotenv.load_dotenv()
+# Max number of chunks read ahead by the network thread before it waits for them to be processed
+STREAM_QUEUE_SIZE = 256
 
-    url = "https://id.barentswatch.no/connect/token"
+# The token is cached across runs, and reused as long as it is valid for at least a minute more
+TOKEN_CACHE_PATH = Path.home() / ".cache" / "fleetspeed" / "token.json"
+TOKEN_MIN_REMAINING_SECS = 60
 
-    payload = {
-        "grant_type": "client_credentials",
-        "scope": "ais",
-        "client_id": os.environ["CLIENT_ID"],
-        "client_secret": os.environ["CLIENT_SECRET"],
-    }
+TOKEN_URL = "https://id.barentswatch.no/connect/token"
+TOKEN_REQUEST_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Accept": "application/json",
+}
 
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
 
-    response = httpx.post(url, headers=headers, data=payload)
-    response.raise_for_status()
+class TokenResponse(msgspec.Struct):
+    access_token: str
+    # A token without a stated lifetime is treated as expired, and so never reused
+    expires_in: float = 0.0
+
+
+TOKEN_RESPONSE_DECODER = msgspec.json.Decoder(TokenResponse)
+
+# Created on first use and kept open until closed, so that renewing the token reuses the
+# connection instead of a new TCP and TLS handshake
+token_client: httpx.AsyncClient | None = None
+# The token request never changes, so its body is encoded once, on first use
+token_request_body: bytes | None = None
+# The token in use and its expiry time, so that later calls skip reading the cache file
+current_token: tuple[str, float] | None = None
+# The renewal in progress, which is shared by all callers waiting for a new token
+token_renewal: asyncio.Task[str] | None = None
 
-    response_json = response.json()
+
+async def get_bw_token() -> str:
+    global token_renewal
+
+    if current_token is not None and is_token_valid(current_token[1]):
+        return current_token[0]
+
+    if token_renewal is None:
+        token_renewal = asyncio.create_task(renew_token())
+    # Shielded, so that a cancelled caller does not cancel the renewal for the others
+    return await asyncio.shield(token_renewal)
+
+
+async def renew_token() -> str:
+    global current_token, token_renewal
 
     try:
-        return response_json["access_token"]
-    except KeyError:
+        current_token = read_cached_token()
+        if current_token is None:
+            current_token = await fetch_bw_token()
+            write_cached_token(*current_token)
+        return current_token[0]
+    finally:
+        token_renewal = None
+
+
+def get_token_request_body() -> bytes:
+    global token_request_body
+
+    if token_request_body is None:
+        if config.CLIENT_ID is None or config.CLIENT_SECRET is None:
+            raise ValueError("CLIENT_ID and CLIENT_SECRET must be set to get a token.")
+
+        token_request_body = urlencode(
+            {
+                "grant_type": "client_credentials",
+                "scope": "ais",
+                "client_id": config.CLIENT_ID,
+                "client_secret": config.CLIENT_SECRET,
+            }
+        ).encode()
+    return token_request_body
+
+
+def is_token_valid(expires_at: float) -> bool:
+    return expires_at - time.time() >= TOKEN_MIN_REMAINING_SECS
+
+
+async def close_token_client() -> None:
+    global token_client
+
+    if token_client is not None:
+        await token_client.aclose()
+        token_client = None
+
+
+async def fetch_bw_token() -> tuple[str, float]:
+    global token_client
+
+    if token_client is None:
+        token_client = httpx.AsyncClient()
+    response = await token_client.post(
+        TOKEN_URL, headers=TOKEN_REQUEST_HEADERS, content=get_token_request_body()
+    )
+    response.raise_for_status()
+
+    try:
+        token_response = TOKEN_RESPONSE_DECODER.decode(response.content)
+    except msgspec.DecodeError:
         raise ValueError(f"Unexpected response format '{response.text}'.")
 
+    return token_response.access_token, time.time() + token_response.expires_in
+
 
-async def get_bw_stream(token) -> AsyncGenerator[str, None]:
+def read_cached_token() -> tuple[str, float] | None:
+    try:
+        cached = json.loads(TOKEN_CACHE_PATH.read_text())
+        token, expires_at = cached["token"], cached["expires_at"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    return (token, expires_at) if is_token_valid(expires_at) else None
+
+
+def write_cached_token(token: str, expires_at: float):
+    # The cache is only an optimization, so failing to write it is not an error
+    try:
+        TOKEN_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # Only readable by the user, as the token gives access to the API. The mode given to touch
+        # only applies to a new file, so an existing file is changed before the token is written.
+        TOKEN_CACHE_PATH.touch(mode=0o600)
+        TOKEN_CACHE_PATH.chmod(0o600)
+        TOKEN_CACHE_PATH.write_text(json.dumps({"token": token, "expires_at": expires_at}))
+    except OSError:
+        pass
+
+
+async def get_bw_stream(token) -> AsyncGenerator[bytes, None]:
+    # The blocking reads run in their own thread and release the GIL while waiting on the socket,
+    # so the event loop can process the previous chunks in the meantime
+    async for line in split_lines(iterate_in_thread(read_bw_stream(token))):
+        yield line
+
+
+def read_bw_stream(token) -> Iterator[bytes]:
     auth_str = f"Bearer {token}"  # complete authorization string
 
     headers = {
@@ -40,10 +157,118 @@ async def get_bw_stream(token) -> AsyncGenerator[str, None]:
         "Authorization": auth_str,
     }
 
-    async with httpx.AsyncClient() as client:
-        async with client.stream(
+    with httpx.Client() as client:
+        with client.stream(
             "GET", "https://live.ais.barentswatch.no/v1/ais", headers=headers
         ) as response:
             response.raise_for_status()
-            async for line in response.aiter_lines():
-                yield line
+            # Each chunk is a single network read of up to 64 KiB, with no text decoding
+            yield from response.iter_bytes()
+
+
+async def iterate_in_thread(
+    iterator: Iterator[T], queue_size: int = STREAM_QUEUE_SIZE
+) -> AsyncGenerator[T, None]:
+    """
+    Asynchronously iterate over a blocking iterator, which is run in a separate thread.
+
+    The items are handed over to the event loop through a bounded queue. When the queue is full,
+    the thread waits for the items to be consumed. An exception raised by the iterator is raised
+    again here, after the items preceding it. When the consumer stops, the thread stops too, but
+    only once the iterator has returned its next item.
+
+    Args:
+        iterator (Iterator[T]): A blocking iterator, e.g. reading from a socket.
+        queue_size (int, optional): The max number of items waiting to be consumed.
+
+    Yields:
+        T: The items of the iterator.
+    """
+    loop = asyncio.get_running_loop()
+    item_queue = asyncio.Queue(maxsize=queue_size)
+    end_of_iterator = object()
+    stop = threading.Event()
+    error = None
+
+    def put(item) -> bool:
+        # The consumer may have stopped, and its event loop been closed, at any point
+        if stop.is_set():
+            return False
+        put_item = item_queue.put(item)
+        try:
+            future = asyncio.run_coroutine_threadsafe(put_item, loop)
+        except RuntimeError:  # the event loop is closed
+            put_item.close()
+            return False
+
+        # Waits in steps, so that it gives up if the consumer stops while the queue is full
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except TimeoutError:
+                if stop.is_set() or loop.is_closed():
+                    future.cancel()
+                    return False
+            except concurrent.futures.CancelledError:  # cancelled by the event loop, e.g. on exit
+                return False
+
+    def produce() -> None:
+        nonlocal error
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except Exception as e:
+            error = e
+        put(end_of_iterator)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while (item := await item_queue.get()) is not end_of_iterator:
+            yield item
+    finally:
+        stop.set()
+        # Make room in case the thread is waiting on a full queue, so that it sees the stop
+        if not item_queue.empty():
+            item_queue.get_nowait()
+
+    if error is not None:
+        raise error
+
+
+async def split_lines(
+    chunk_generator: AsyncGenerator[bytes, None]
+) -> AsyncGenerator[bytes, None]:
+    """
+    Asynchronously split a stream of byte chunks into lines.
+
+    Lines may span several chunks, so the pieces of an incomplete line are kept until the rest of
+    the line arrives, and joined only once. Each chunk is split in a single call to bytes.split, so
+    that searching for the newlines and copying out the lines is done in C. The lines are yielded
+    as bytes, without the trailing newline. The chunks are never decoded, which is safe as a newline
+    byte is never part of a multibyte UTF-8 character. Decoding is left to the JSON parser, which
+    works directly on UTF-8 bytes.
+
+    Args:
+        chunk_generator (AsyncGenerator[bytes, None]): An asynchronous generator yielding chunks of
+        bytes.
+
+    Yields:
+        bytes: A single line.
+    """
+    incomplete_line = []
+
+    async for chunk in chunk_generator:
+        incomplete_line.append(chunk)
+        if b"\n" not in chunk:
+            continue
+
+        *lines, rest = b"".join(incomplete_line).split(b"\n")
+        incomplete_line = [rest]
+        for line in lines:
+            yield line
+
+    if rest := b"".join(incomplete_line):
+        yield rest
@@ -1,8 +1,36 @@
+import time
+from typing import Iterable
+
 import polars as pl
 from rich.table import Table
 
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 
 def dataframe_to_table(df: pl.DataFrame) -> Table:
+    # column ordering is important, and the values are formatted to strings by Polars in bulk
+    df = df.select(
+        "mmsi",
+        pl.col("speedOverGround").round(1).cast(pl.Utf8),
+        # msgtime is in ns since the Unix epoch, and only converted here for the displayed rows
+        pl.from_epoch("msgtime", time_unit="ns").dt.strftime(TIME_FORMAT),
+    )
+
+    return strings_to_table(df.iter_rows())
+
+
+def rows_to_table(rows: Iterable[tuple[str, float, int]]) -> Table:
+    return strings_to_table(
+        (
+            mmsi,
+            f"{speed_over_ground:.1f}",
+            time.strftime(TIME_FORMAT, time.gmtime(msgtime // 1_000_000_000)),
+        )
+        for mmsi, speed_over_ground, msgtime in rows
+    )
+
+
+def strings_to_table(rows: Iterable[tuple[str, str, str]]) -> Table:
     table = Table(
         show_header=True,
         header_style="bold magenta",
@@ -10,13 +38,11 @@ def dataframe_to_table(df: pl.DataFrame) -> Table:
         title="FleetSpeed - The Fastest Vessels in Norway Right Now",
     )
 
-    # column ordering is important
-    df = df.select("mmsi", "speedOverGround", "msgtime")
-
     table.add_column("Vessel MMSI", style="cyan", justify="center", width=12)
     table.add_column("Speed (kn)", style="bold red", justify="right", width=12)
     table.add_column("Measured at", style="orange_red1", justify="center", width=21)
 
-    for row in df.iter_rows():
-        table.add_row(*(str(itm) for itm in row))
+    # rows of formatted mmsi, speedOverGround and msgtime
+    for row in rows:
+        table.add_row(*row)
     return table
@@ -0,0 +1,10 @@
+import pytest
+import uvloop
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    # One loop for the whole test session, of the same kind as used by main.py
+    loop = uvloop.new_event_loop()
+    yield loop
+    loop.close()
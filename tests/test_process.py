@@ -1,9 +1,22 @@
 # ruff: noqa: E501
+import asyncio
 from datetime import datetime, timedelta
 
 import polars as pl
 import pytest
-from process import rank_by_speed, strip_data, validate_extract_vessel_data
+from process import (
+    batch_stream,
+    rank_by_speed,
+    strip_data,
+    strip_max_speeds,
+    top_max_speeds,
+    update_max_speeds,
+    validate_batch,
+    validate_extract_vessel_data,
+)
+
+# 2022-12-12T10:10:10Z in ns since the Unix epoch
+MSGTIME_NS = 1_670_839_810 * 1_000_000_000
 
 
 @pytest.mark.parametrize(
@@ -11,19 +24,11 @@ from process import rank_by_speed, strip_data, validate_extract_vessel_data
     [
         (
             '{"mmsi": "123456789", "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
-            {
-                "mmsi": "123456789",
-                "speedOverGround": 5.0,
-                "msgtime": datetime(2022, 12, 12, 10, 10, 10),
-            },
+            ("123456789", 5.0, MSGTIME_NS),
         ),
         (
             '{"mmsi": 123456789, "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
-            {
-                "mmsi": "123456789",
-                "speedOverGround": 5.0,
-                "msgtime": datetime(2022, 12, 12, 10, 10, 10),
-            },
+            ("123456789", 5.0, MSGTIME_NS),
         ),
         (
             '{"mmsi": "abcd", "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
@@ -33,26 +38,39 @@ from process import rank_by_speed, strip_data, validate_extract_vessel_data
             '{"mmsi": "123", "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
             None,
         ),
+        (
+            '{"mmsi": "١٢٣٤٥٦٧٨٩", "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
+            None,
+        ),
         (
             '{"mmsi": "123456789", "speedOverGround": -5.0, "msgtime": "2022-12-12T10:10:10"}',
             None,
         ),
         (
             '{"mmsi": "123456789", "speedOverGround": 5.0, "extra": "field", "msgtime": "2022-12-12T10:10:10"}',
-            {
-                "mmsi": "123456789",
-                "speedOverGround": 5.0,
-                "msgtime": datetime(2022, 12, 12, 10, 10, 10),
-            },
+            ("123456789", 5.0, MSGTIME_NS),
+        ),
+        (
+            '{"mmsi": "123456789", "speedOverGround": "fast", "msgtime": "2022-12-12T10:10:10"}',
+            None,
+        ),
+        (
+            '{"mmsi": "123456789", "speedOverGround": true, "msgtime": "2022-12-12T10:10:10"}',
+            None,
+        ),
+        (
+            '{"mmsi": "123456789", "speedOverGround": 5.0}',
+            None,
         ),
         ("not_a_valid_json", None),
+        ("[]", None),
         (
             '{"mmsi": "123456789", "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10.123456"}',
-            {
-                "mmsi": "123456789",
-                "speedOverGround": 5.0,
-                "msgtime": datetime(2022, 12, 12, 10, 10, 10),
-            },
+            ("123456789", 5.0, MSGTIME_NS),
+        ),
+        (
+            '{"mmsi": "123456789", "speedOverGround": 5.0, "msgtime": "2022-12-12T11:10:10+01:00"}',
+            ("123456789", 5.0, MSGTIME_NS),
         ),
     ],
 )
@@ -63,19 +81,67 @@ def test_validate_extract_vessel_data(input_line, expected_result):
         assert actual is None
 
     else:
-        assert "created_at" in actual
-        assert isinstance(actual.pop("created_at"), int)
+        *fields, created_at = actual
+        assert isinstance(created_at, int)
+
+        assert tuple(fields) == expected_result
+
+
+@pytest.mark.parametrize(
+    "invalid_line",
+    [
+        None,
+        # Forces the per-line fallback
+        b"not_a_valid_json",
+        b'{"mmsi": 123456789.5, "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
+        "{\"mmsi\": \"१२३४५६७८९\", \"speedOverGround\": 5.0, \"msgtime\": \"2022-12-12T10:10:10\"}".encode(),
+    ],
+)
+def test_validate_batch(invalid_line):
+    lines = [
+        b'{"mmsi": 123456789, "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10.123456"}',
+        b'{"mmsi": 123, "speedOverGround": 5.0, "msgtime": "2022-12-12T10:10:10"}',
+        b'{"mmsi": 123456789, "speedOverGround": -5.0, "msgtime": "2022-12-12T10:10:10"}',
+        b'{"mmsi": 123456789, "msgtime": "2022-12-12T10:10:10"}',
+        b'{"mmsi": 987654321, "speedOverGround": 7, "extra": "field", "msgtime": "2022-12-12T10:10:11"}',
+        b'{"mmsi": "111222333", "speedOverGround": 3.0, "msgtime": "2022-12-12T10:10:12"}',
+    ]
+    if invalid_line is not None:
+        lines.insert(1, invalid_line)
 
-        assert actual == expected_result
+    df = validate_batch(lines)
+
+    assert df.columns == ["mmsi", "speedOverGround", "msgtime", "created_at"]
+    assert df.get_column("created_at").dtype == pl.Int64
+    assert df.drop("created_at").to_dicts() == [
+        {
+            "mmsi": "123456789",
+            "speedOverGround": 5.0,
+            "msgtime": MSGTIME_NS,
+        },
+        {
+            "mmsi": "987654321",
+            "speedOverGround": 7.0,
+            "msgtime": MSGTIME_NS + 1_000_000_000,
+        },
+        {
+            "mmsi": "111222333",
+            "speedOverGround": 3.0,
+            "msgtime": MSGTIME_NS + 2_000_000_000,
+        },
+    ]
 
 
 def test_strip_data():
     # Common Data: This data set would be used in all cases for consistency.
-    data = [
-        {"created_at": (datetime.now() - timedelta(seconds=5)).timestamp() * 1e9},
-        {"created_at": (datetime.now() - timedelta(seconds=3)).timestamp() * 1e9},
-        {"created_at": datetime.now().timestamp() * 1e9},
-    ]
+    data = {
+        "mmsi": ["1", "2", "3"],
+        "created_at": [
+            (datetime.now() - timedelta(seconds=5)).timestamp() * 1e9,
+            (datetime.now() - timedelta(seconds=3)).timestamp() * 1e9,
+            datetime.now().timestamp() * 1e9,
+        ],
+    }
 
     # Case 1: If the data has fewer messages than num_messages_to_keep,
     # it should return all messages.
@@ -85,11 +151,11 @@ def test_strip_data():
     # Case 2: If the time to live cutoff would result fewer than num_messages_to_keep,
     # it should return fixed number of recent messages.
     result_case2 = strip_data(data, time_to_live_secs=1, num_messages_to_keep=2)
-    assert result_case2 == data[-2:], "Case 2 failed."
+    assert result_case2 == {name: column[-2:] for name, column in data.items()}, "Case 2 failed."
 
     # Case 3: Return all data that are more recent than the time cutoff.
     result_case3 = strip_data(data, time_to_live_secs=4, num_messages_to_keep=1)
-    assert result_case3 == data[1:], "Case 3 failed."
+    assert result_case3 == {name: column[1:] for name, column in data.items()}, "Case 3 failed."
 
 
 def test_rank_by_speed():
@@ -120,3 +186,79 @@ def test_rank_by_speed():
     # Call the function and compare the result with expected using Polars frame_equal method
     result = rank_by_speed(df)
     assert result.frame_equal(expected)
+
+
+def test_rank_by_speed_top():
+    df = pl.DataFrame(
+        {
+            "mmsi": ["1", "2", "3", "1", "2"],
+            "speedOverGround": [1.0, 2.0, 3.0, 4.0, 5.0],
+            "msgtime": ["2000-01-01", "2000-01-02", "2000-01-03", "2000-01-04", "2000-01-05"],
+        }
+    )
+
+    # Each vessel is listed with the msgtime of its maximum speed
+    expected = pl.DataFrame(
+        {
+            "speedOverGround": [5.0, 4.0],
+            "mmsi": ["2", "1"],
+            "msgtime": ["2000-01-05", "2000-01-04"],
+        }
+    )
+
+    result = rank_by_speed(df, num_vessels=2)
+    assert result.frame_equal(expected)
+
+
+def test_max_speeds():
+    now = datetime.now()
+    old = (now - timedelta(seconds=20)).timestamp() * 1e9
+    new = now.timestamp() * 1e9
+    msgtime = MSGTIME_NS
+    messages = [
+        ("1", 1.0, msgtime, old),
+        ("2", 2.0, msgtime, new),
+        ("3", 3.0, msgtime, new),
+        ("1", 4.0, msgtime, new),
+        ("2", 1.0, msgtime, new),  # Slower than the current maximum, kept for when it expires
+        ("4", 9.0, msgtime, old),  # Older than the Time To Live, stripped
+        ("5", 30.0, msgtime, old),  # Maximum expires, but the later and slower message is kept
+        ("5", 20.0, msgtime + 1, new),
+    ]
+
+    def max_speeds_of(messages):
+        max_speeds = {}
+        for message_number, vessel_data in enumerate(messages):
+            update_max_speeds(max_speeds, vessel_data, message_number)
+        return max_speeds
+
+    max_speeds = max_speeds_of(messages)
+    assert list(max_speeds["1"]) == [(4.0, msgtime, new, 3)]
+    assert list(max_speeds["2"]) == [(2.0, msgtime, new, 1), (1.0, msgtime, new, 4)]
+
+    strip_max_speeds(max_speeds, time_to_live_secs=10, num_messages_to_keep=0, num_messages=8)
+    assert set(max_speeds) == {"1", "2", "3", "5"}
+
+    assert top_max_speeds(max_speeds, num_vessels=3) == [
+        ("5", 20.0, msgtime + 1),
+        ("1", 4.0, msgtime),
+        ("3", 3.0, msgtime),
+    ]
+
+    # The most recent messages are kept regardless of the Time To Live
+    max_speeds = max_speeds_of(messages)
+    strip_max_speeds(max_speeds, time_to_live_secs=10, num_messages_to_keep=3, num_messages=8)
+    assert top_max_speeds(max_speeds, num_vessels=2) == [("5", 30.0, msgtime), ("4", 9.0, msgtime)]
+
+
+async def test_batch_stream():
+    async def item_generator():
+        for item in range(6):
+            yield item
+            # Items 0-2 arrive within the first interval, and 3 is the first one after it
+            await asyncio.sleep(0.1 if item == 2 else 0)
+
+    batches = [batch async for batch in batch_stream(item_generator(), batch_interval_secs=0.05)]
+
+    # The last items are never yielded, as no item arrives after their interval
+    assert batches == [[0, 1, 2, 3]]
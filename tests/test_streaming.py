@@ -1,32 +1,126 @@
-import pytest
-from streaming import get_bw_token
-
+import asyncio
+import itertools
+import threading
+from time import time
 
-class MockHttpxResponse:
-    def __init__(self, json_data, status_code=200):
-        self._json = json_data
-        self.status_code = status_code
+import httpx
+import pytest
+import respx
+import streaming
+from streaming import get_bw_token, iterate_in_thread, split_lines
 
-    def json(self):
-        return self._json
 
-    def raise_for_status(self):
-        if self.status_code != 200:
-            raise Exception("Mock http error")
+async def mock_token_response(_):
+    await asyncio.sleep(0)  # waiting for the response lets other tasks run
+    return httpx.Response(200, json={"access_token": "mock_token", "expires_in": 3600})
 
 
-def mock_httpx_post(*_, **__):
-    return MockHttpxResponse(json_data={"access_token": "mock_token"})
+@pytest.fixture(scope="session")
+def token_route():
+    # The transport is mocked once for all tests, and any other request fails
+    with respx.mock(assert_all_called=False) as router:
+        yield router.post(streaming.TOKEN_URL).mock(side_effect=mock_token_response)
 
 
 @pytest.fixture
-def mock_functions(monkeypatch):
-    monkeypatch.setattr("httpx.post", mock_httpx_post)
+def mock_functions(token_route, monkeypatch, tmp_path):
+    token_route.reset()
+    monkeypatch.setattr(streaming, "TOKEN_CACHE_PATH", tmp_path / "token.json")
+    monkeypatch.setattr(
+        streaming,
+        "token_request_body",
+        b"grant_type=client_credentials&scope=ais&client_id=x&client_secret=y",
+    )
+    monkeypatch.setattr(streaming, "current_token", None)
+    monkeypatch.setattr(streaming, "token_renewal", None)
 
 
-def test_get_bw_token(mock_functions):
-    token = get_bw_token()
+async def test_get_bw_token(mock_functions):
+    token = await get_bw_token()
     assert token == "mock_token"
 
 
+async def test_get_bw_token_cached(mock_functions, token_route, monkeypatch):
+    assert await get_bw_token() == "mock_token"
+    assert await get_bw_token() == "mock_token"
+    assert token_route.call_count == 1
+    assert streaming.TOKEN_CACHE_PATH.stat().st_mode & 0o777 == 0o600
+
+    # A new run only has the cache file, which is reused until the token is about to expire
+    monkeypatch.setattr(streaming, "current_token", None)
+    assert await get_bw_token() == "mock_token"
+    assert token_route.call_count == 1
+
+    monkeypatch.setattr(streaming, "current_token", None)
+    streaming.TOKEN_CACHE_PATH.write_text(f'{{"token": "old_token", "expires_at": {time() + 30}}}')
+    streaming.TOKEN_CACHE_PATH.chmod(0o644)
+    assert await get_bw_token() == "mock_token"
+    assert token_route.call_count == 2
+    assert streaming.TOKEN_CACHE_PATH.stat().st_mode & 0o777 == 0o600
+
+
+async def test_get_bw_token_concurrent(mock_functions, token_route):
+    tokens = await asyncio.gather(*(get_bw_token() for _ in range(50)))
+
+    assert tokens == ["mock_token"] * 50
+    assert token_route.call_count == 1
+
+
 # Decided not to unit test get_bw_stream due to complexity, including extra dependencies.
+
+
+async def chunk_generator(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.parametrize(
+    "chunks, expected",
+    [
+        (
+            [b'{"a": 1}\n{"b"', b": 2}\n", b'{"c": 3}\n{"d": 4}'],
+            [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}', b'{"d": 4}'],
+        ),
+        # single byte chunks
+        ([bytes([byte]) for byte in b'{"a": 1}\n{"b": 2}\n'], [b'{"a": 1}', b'{"b": 2}']),
+        # the stream is never decoded, so characters split across chunks are joined back in the line
+        ([b'{"name": "\xc3', b'\xa9"}\n'], ['{"name": "é"}'.encode()]),
+        # full size network reads, with lines ending at and spanning the chunk boundaries
+        ([b"x" * 65535 + b"\n"] * 4, [b"x" * 65535] * 4),
+        ([b"x" * 65536] * 4, [b"x" * 4 * 65536]),
+        # empty trailing chunk
+        ([b"ok\n", b""], [b"ok"]),
+    ],
+)
+async def test_split_lines(chunks, expected):
+    lines = [line async for line in split_lines(chunk_generator(chunks))]
+
+    assert lines == expected
+    # a bytearray compares equal to bytes, but is mutable and copied defensively by consumers
+    assert all(type(line) is bytes for line in lines)
+
+
+async def test_iterate_in_thread():
+    def failing_iterator():
+        yield from range(10)
+        raise ValueError("Mock read error")
+
+    items = []
+    with pytest.raises(ValueError, match="Mock read error"):
+        async for item in iterate_in_thread(failing_iterator(), queue_size=2):
+            items.append(item)
+
+    assert items == list(range(10))
+
+
+async def test_iterate_in_thread_stopped():
+    threads = set(threading.enumerate())
+
+    items = iterate_in_thread(itertools.count(), queue_size=1)
+    assert await anext(items) == 0
+    [thread] = set(threading.enumerate()) - threads
+    await items.aclose()
+
+    # The thread stops reading instead of waiting on the full queue for a consumer that is gone
+    thread.join(timeout=5)
+    assert not thread.is_alive()